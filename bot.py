@@ -1,13 +1,25 @@
+import asyncio
+import atexit
 import logging
+import multiprocessing
 import os
 import io
-import json
-from dataclasses import dataclass, asdict, field
-from typing import Dict, Optional, List, Any
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import Dict, Optional, List, Any, Tuple
 from datetime import datetime
+from enum import IntEnum, auto
 from decimal import Decimal
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extras import Json, RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -18,6 +30,7 @@ from reportlab.pdfbase.ttfonts import TTFont
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CommandHandler,
     ContextTypes,
@@ -33,11 +46,25 @@ from telegram.ext import (
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
 DATABASE_URL = os.getenv("DATABASE_URL", "")
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# psycopg2 closes connections returned beyond minconn, so keep the whole pool warm
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", str(DB_POOL_MAX)))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+DB_IDLE_TX_TIMEOUT_MS = int(os.getenv("DB_IDLE_TX_TIMEOUT_MS", "10000"))
+# Named prepared statements don't survive PgBouncer transaction pooling
+DB_USE_PREPARED = os.getenv("DB_USE_PREPARED", "1") == "1"
+# Document inserts arriving within this window are written in one statement
+SAVE_BATCH_DELAY = float(os.getenv("SAVE_BATCH_DELAY", "0.05"))
+SAVE_BATCH_MAX = int(os.getenv("SAVE_BATCH_MAX", "32"))
+# Per-user cache of the "My documents" listing
+DOCS_CACHE_TTL = float(os.getenv("DOCS_CACHE_TTL", "60"))
+DOCS_CACHE_MAX = int(os.getenv("DOCS_CACHE_MAX", "1024"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
 
 # Logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
 )
 logger = logging.getLogger(__name__)
 
@@ -45,56 +72,58 @@ logger = logging.getLogger(__name__)
 # CONVERSATION STATES
 # =========================================================
 
-(
-    MAIN_MENU,
-    SELECT_TEMPLATE,
+class States(IntEnum):
+    MAIN_MENU = auto()
+    SELECT_TEMPLATE = auto()
     # Basic form fields
-    FORM_FIRST_NAME,
-    FORM_LAST_NAME,
-    FORM_ADDRESS,
-    FORM_CITY,
-    FORM_POSTAL_CODE,
-    FORM_UNIT,
-    FORM_PHONE,
+    FORM_FIRST_NAME = auto()
+    FORM_LAST_NAME = auto()
+    FORM_ADDRESS = auto()
+    FORM_CITY = auto()
+    FORM_POSTAL_CODE = auto()
+    FORM_UNIT = auto()
+    FORM_PHONE = auto()
     # Payroll specific
-    PAYROLL_EMPLOYER,
-    PAYROLL_SALARY,
-    PAYROLL_PERIOD,
-    PAYROLL_PROVINCE,
-    PAYROLL_HOURS,
-    PAYROLL_RATE,
+    PAYROLL_EMPLOYER = auto()
+    PAYROLL_SALARY = auto()
+    PAYROLL_PERIOD = auto()
+    PAYROLL_PROVINCE = auto()
+    PAYROLL_HOURS = auto()
+    PAYROLL_RATE = auto()
     # Bank specific
-    BANK_NAME,
-    BANK_ACCOUNT,
-    BANK_BALANCE,
-    BANK_TRANSACTIONS,
+    BANK_NAME = auto()
+    BANK_ACCOUNT = auto()
+    BANK_BALANCE = auto()
+    BANK_TRANSACTIONS = auto()
     # Bill specific
-    BILL_COMPANY,
-    BILL_AMOUNT,
-    BILL_DUE_DATE,
-    BILL_SERVICE,
+    BILL_COMPANY = auto()
+    BILL_AMOUNT = auto()
+    BILL_DUE_DATE = auto()
+    BILL_SERVICE = auto()
     # T4/T4A specific
-    T4_EMPLOYER_NAME,
-    T4_EMPLOYER_BN,
-    T4_EMPLOYMENT_INCOME,
-    T4_CPP_CONTRIBUTION,
-    T4_EI_PREMIUM,
-    T4_TAX_DEDUCTED,
-    T4_YEAR,
-    T4_PROVINCE,
-    T4_OTHER_INCOME,
+    T4_EMPLOYER_NAME = auto()
+    T4_EMPLOYER_BN = auto()
+    T4_EMPLOYMENT_INCOME = auto()
+    T4_CPP_CONTRIBUTION = auto()
+    T4_EI_PREMIUM = auto()
+    T4_TAX_DEDUCTED = auto()
+    T4_YEAR = auto()
+    T4_PROVINCE = auto()
+    T4_OTHER_INCOME = auto()
     # Employment Letter specific
-    LETTER_EMPLOYER_NAME,
-    LETTER_EMPLOYER_ADDRESS,
-    LETTER_JOB_TITLE,
-    LETTER_START_DATE,
-    LETTER_SALARY,
-    LETTER_EMPLOYMENT_TYPE,
-    LETTER_PURPOSE,
-    LETTER_END_DATE,
+    LETTER_EMPLOYER_NAME = auto()
+    LETTER_EMPLOYER_ADDRESS = auto()
+    LETTER_JOB_TITLE = auto()
+    LETTER_START_DATE = auto()
+    LETTER_SALARY = auto()
+    LETTER_EMPLOYMENT_TYPE = auto()
+    LETTER_PURPOSE = auto()
+    LETTER_END_DATE = auto()
     # Confirmation
-    CONFIRM,
-) = range(42)
+    CONFIRM = auto()
+
+# Expose members at module level (MAIN_MENU, FORM_FIRST_NAME, ...) for the handlers
+globals().update(States.__members__)
 
 # =========================================================
 # TEMPLATES
@@ -153,11 +182,31 @@ TEMPLATES = {
     },
 }
 
+CATEGORY_NAMES = {cat_key: cat_data["name"] for cat_key, cat_data in TEMPLATES.items()}
+
+# template_id -> (category, name, desc), built once instead of scanning TEMPLATES
+TEMPLATE_INDEX = {
+    tpl["id"]: (cat_key, tpl["name"], tpl["desc"])
+    for cat_key, cat_data in TEMPLATES.items()
+    for tpl in cat_data["templates"]
+}
+
+# Template keyboard callback_data -> template_id. Category keys contain underscores
+# (employment_letter), so the callback can't be split back apart on "_".
+TEMPLATE_CALLBACKS = {
+    f"TPL_{cat_key}_{tpl['id']}": tpl["id"]
+    for cat_key, cat_data in TEMPLATES.items()
+    for tpl in cat_data["templates"]
+}
+
+# template_id -> name as used in generated filenames
+TEMPLATE_FILE_NAMES = {tpl_id: name.replace(" ", "_") for tpl_id, (_, name, _) in TEMPLATE_INDEX.items()}
+
 # =========================================================
 # FORM DATA CLASS
 # =========================================================
 
-@dataclass
+@dataclass(slots=True)
 class FormData:
     # User info
     user_id: int = 0
@@ -218,168 +267,578 @@ class FormData:
     end_date: str = ""
 
     def to_dict(self) -> Dict:
-        return asdict(self)
+        # All fields are flat, so this is equivalent to asdict() without the deep copy
+        return {name: getattr(self, name) for name in FORM_FIELDS}
+
+FORM_FIELDS = tuple(f.name for f in fields(FormData))
 
 # =========================================================
 # DATABASE FUNCTIONS
 # =========================================================
 
-def get_db_connection():
-    """Get database connection."""
+# Single-row hot queries, executed through server-side prepared statements
+UPSERT_USER_SQL = """
+    INSERT INTO users (user_id, username, first_name, last_name, last_active)
+    VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        last_active = CURRENT_TIMESTAMP
+"""
+# Bumps the user's document_count in the same statement as the insert
+INSERT_DOCUMENT_SQL = """
+    WITH doc AS (
+        INSERT INTO documents (user_id, username, category, template_id, form_data)
+        VALUES ($1, $2, $3, $4, $5)
+        RETURNING id
+    ), counted AS (
+        UPDATE users SET document_count = document_count + 1
+        WHERE user_id = $1
+    )
+    SELECT id FROM doc
+"""
+# Multi-row variant for execute_values, bumping each user's count by their row total.
+# Not prepared: the VALUES list changes length with every batch.
+INSERT_DOCUMENTS_BULK_SQL = """
+    WITH doc AS (
+        INSERT INTO documents (user_id, username, category, template_id, form_data)
+        VALUES %s
+        RETURNING id, user_id
+    ), counted AS (
+        UPDATE users SET document_count = users.document_count + c.n
+        FROM (SELECT user_id, count(*) AS n FROM doc GROUP BY user_id) AS c
+        WHERE users.user_id = c.user_id
+    )
+    SELECT id FROM doc ORDER BY id
+"""
+SELECT_USER_DOCUMENTS_SQL = """
+    SELECT id, category, template_id, created_at
+    FROM documents
+    WHERE user_id = $1 AND created_at > now() - interval '180 days'
+    ORDER BY created_at DESC
+    LIMIT $2
+"""
+
+class PreparingConnection(PgConnection):
+    """Connection that remembers which statements it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+def execute_prepared(cur, name: str, sql: str, params: tuple):
+    """Execute `sql` as a named prepared statement, preparing it once per connection."""
+    if not DB_USE_PREPARED:
+        # $n may repeat, so bind by name rather than by position
+        cur.execute(re.sub(r"\$(\d+)", r"%(p\1)s", sql), {f"p{i}": value for i, value in enumerate(params, 1)})
+        return
+    conn = cur.connection
+    if name not in conn.prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+_POOL: Optional[ThreadedConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+def get_db_pool() -> Optional[ThreadedConnectionPool]:
+    """Get the shared connection pool, creating it on first use.
+
+    Connections enable TCP keepalives so dead peers are noticed in ~80s rather
+    than the OS default of hours, and set statement/idle-in-transaction
+    timeouts so a stuck query can't hold a pool slot indefinitely. Set
+    DB_USE_PREPARED=0 when connecting through PgBouncer in transaction mode.
+    """
+    global _POOL
+    if _POOL is not None:
+        return _POOL
     if not DATABASE_URL:
         logger.warning("DATABASE_URL not set")
         return None
+    with _POOL_LOCK:
+        if _POOL is not None:
+            return _POOL
+        try:
+            _POOL = ThreadedConnectionPool(
+                min(DB_POOL_MIN, DB_POOL_MAX), DB_POOL_MAX, DATABASE_URL,
+                connection_factory=PreparingConnection, cursor_factory=RealDictCursor,
+                keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5,
+                options=(
+                    f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS} "
+                    f"-c idle_in_transaction_session_timeout={DB_IDLE_TX_TIMEOUT_MS}"
+                ),
+            )
+            atexit.register(close_db_pool)
+        except Exception as e:
+            logger.error("Database connection error: %s", e)
+            return None
+    return _POOL
+
+def close_db_pool():
+    """Close every pooled connection."""
+    global _POOL
+    if _POOL is not None:
+        _POOL.closeall()
+        _POOL = None
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection (None if the database is unavailable).
+
+    Commits when the block exits cleanly, rolls back and re-raises otherwise,
+    and always returns the connection to the pool.
+    """
+    pool = get_db_pool()
+    if pool is None:
+        yield None
+        return
+    conn = pool.getconn()
     try:
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        return None
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+# getconn() raises PoolError rather than blocking once every connection is out,
+# so handlers run DB helpers on a thread pool no larger than the connection pool.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+
+async def run_db(func, *args):
+    """Run a blocking DB helper without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_DB_EXECUTOR, func, *args)
 
 def init_database():
     """Initialize database tables."""
-    conn = get_db_connection()
-    if not conn:
+    try:
+        with db_conn() as conn:
+            if conn is None:
+                return
+            with conn.cursor() as cur:
+                # Documents table
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS documents (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        username VARCHAR(255),
+                        category VARCHAR(50) NOT NULL,
+                        template_id VARCHAR(50) NOT NULL,
+                        form_data JSONB NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+
+                # Users table
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT UNIQUE NOT NULL,
+                        username VARCHAR(255),
+                        first_name VARCHAR(255),
+                        last_name VARCHAR(255),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        document_count INT DEFAULT 0
+                    )
+                """)
+
+                # Create indexes
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)")
+
+                # Migration bookkeeping
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        name VARCHAR(100) PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+
+        logger.info("Database initialized successfully")
+    except Exception as e:
+        logger.error("Database init error: %s", e)
         return
 
+    run_migrations()
+
+def migrate_documents_history_index(cur):
+    """Rebuild the user/created_at index as a covering index; drop the one it supersedes.
+
+    INCLUDE needs PostgreSQL 11+; older servers get the plain composite index,
+    which still serves the listing without a sort.
+    """
+    include = " INCLUDE (id, category, template_id)" if cur.connection.server_version >= 110000 else ""
+    cur.execute("DROP INDEX IF EXISTS idx_documents_user_created")
+    cur.execute(f"CREATE INDEX idx_documents_user_created ON documents(user_id, created_at DESC){include}")
+    # Its leading column is user_id, so the single-column index only adds write cost
+    cur.execute("DROP INDEX IF EXISTS idx_documents_user_id")
+
+# One-off schema changes, applied in order and recorded in schema_migrations
+MIGRATIONS = (
+    ("documents_history_covering_index", migrate_documents_history_index),
+)
+
+def run_migrations():
+    """Apply pending MIGRATIONS, each in its own transaction."""
     try:
-        with conn.cursor() as cur:
-            # Documents table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS documents (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    username VARCHAR(255),
-                    category VARCHAR(50) NOT NULL,
-                    template_id VARCHAR(50) NOT NULL,
-                    form_data JSONB NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Users table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    document_count INT DEFAULT 0
-                )
-            """)
-
-            # Create indexes
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_user_id ON documents(user_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)")
-
-            conn.commit()
-            logger.info("Database initialized successfully")
+        with db_conn() as conn:
+            if conn is None:
+                return
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM schema_migrations")
+                applied = {row['name'] for row in cur.fetchall()}
     except Exception as e:
-        logger.error(f"Database init error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        logger.error("Migration lookup error: %s", e)
+        return
+
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        try:
+            with db_conn() as conn:
+                with conn.cursor() as cur:
+                    migrate(cur)
+                    cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            logger.info("Applied migration %s", name)
+        except Exception as e:
+            # Later migrations may depend on this one; retry them all on the next start
+            logger.error("Migration %s failed: %s", name, e)
+            return
 
 def save_user(user_id: int, username: str, first_name: str, last_name: str):
     """Save or update user in database."""
-    conn = get_db_connection()
-    if not conn:
-        return
-
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO users (user_id, username, first_name, last_name, last_active)
-                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    first_name = EXCLUDED.first_name,
-                    last_name = EXCLUDED.last_name,
-                    last_active = CURRENT_TIMESTAMP
-            """, (user_id, username, first_name, last_name))
-            conn.commit()
+        with db_conn() as conn:
+            if conn is None:
+                return
+            with conn.cursor() as cur:
+                execute_prepared(cur, "upsert_user", UPSERT_USER_SQL, (user_id, username, first_name, last_name))
     except Exception as e:
-        logger.error(f"Save user error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        logger.error("Save user error: %s", e)
 
 def save_document(form_data: FormData) -> Optional[int]:
     """Save document to database."""
-    conn = get_db_connection()
-    if not conn:
+    try:
+        with db_conn() as conn:
+            if conn is None:
+                return None
+            with conn.cursor() as cur:
+                execute_prepared(cur, "insert_document", INSERT_DOCUMENT_SQL, (
+                    form_data.user_id,
+                    form_data.username,
+                    form_data.category,
+                    form_data.template_id,
+                    Json(form_data.to_dict())
+                ))
+                doc_id = cur.fetchone()['id']
+
+        invalidate_user_documents(form_data.user_id)
+        logger.info("Document saved with ID: %s", doc_id)
+        return doc_id
+    except Exception as e:
+        logger.error("Save document error: %s", e)
         return None
 
+def save_documents_bulk(forms: List[FormData]) -> List[Optional[int]]:
+    """Save several documents in one round-trip; returns their IDs in order (None where a row failed)."""
+    if not forms:
+        return []
+    if len(forms) == 1:
+        # The usual case outside bursts; take the prepared single-row insert
+        return [save_document(forms[0])]
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO documents (user_id, username, category, template_id, form_data)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                form_data.user_id,
-                form_data.username,
-                form_data.category,
-                form_data.template_id,
-                json.dumps(form_data.to_dict())
-            ))
-            doc_id = cur.fetchone()['id']
-
-            # Update user document count
-            cur.execute("""
-                UPDATE users SET document_count = document_count + 1
-                WHERE user_id = %s
-            """, (form_data.user_id,))
-
-            conn.commit()
-            logger.info(f"Document saved with ID: {doc_id}")
-            return doc_id
+        with db_conn() as conn:
+            if conn is None:
+                return []
+            with conn.cursor() as cur:
+                rows = execute_values(cur, INSERT_DOCUMENTS_BULK_SQL, [
+                    (f.user_id, f.username, f.category, f.template_id, Json(f.to_dict()))
+                    for f in forms
+                ], page_size=100, fetch=True)
+                doc_ids = [row['id'] for row in rows]
+
+        invalidate_user_documents(*{f.user_id for f in forms})
+        logger.info("Saved %s documents", len(doc_ids))
+        return doc_ids
     except Exception as e:
-        logger.error(f"Save document error: {e}")
-        conn.rollback()
-        return None
-    finally:
-        conn.close()
+        # One bad row fails the whole statement; retry individually so it only costs its own save
+        logger.error("Bulk save documents error, retrying row by row: %s", e)
+        return [save_document(f) for f in forms]
+
+# user_id -> (expires_at, limit, rows), least recently used first
+_DOCS_CACHE: "OrderedDict[int, Tuple[float, int, List[Dict]]]" = OrderedDict()
+_DOCS_CACHE_LOCK = threading.Lock()
+# user_id -> number of invalidations, so a query that raced a save can't cache its stale rows
+_DOCS_GENERATION: Dict[int, int] = {}
+
+def invalidate_user_documents(*user_ids: int):
+    """Drop cached document listings for users whose documents changed."""
+    with _DOCS_CACHE_LOCK:
+        for user_id in user_ids:
+            _DOCS_CACHE.pop(user_id, None)
+            _DOCS_GENERATION[user_id] = _DOCS_GENERATION.get(user_id, 0) + 1
 
 def get_user_documents(user_id: int, limit: int = 10) -> List[Dict]:
-    """Get user's recent documents."""
-    conn = get_db_connection()
-    if not conn:
-        return []
+    """Get user's recent documents, cached for DOCS_CACHE_TTL seconds."""
+    now = time.monotonic()
+    with _DOCS_CACHE_LOCK:
+        cached = _DOCS_CACHE.get(user_id)
+        if cached is not None and cached[0] > now and cached[1] == limit:
+            _DOCS_CACHE.move_to_end(user_id)
+            return cached[2]
+        generation = _DOCS_GENERATION.get(user_id, 0)
 
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, category, template_id, created_at
-                FROM documents
-                WHERE user_id = %s
-                ORDER BY created_at DESC
-                LIMIT %s
-            """, (user_id, limit))
-            return cur.fetchall()
+        with db_conn() as conn:
+            if conn is None:
+                return []
+            with conn.cursor() as cur:
+                execute_prepared(cur, "select_user_documents", SELECT_USER_DOCUMENTS_SQL, (user_id, limit))
+                docs = cur.fetchall()
     except Exception as e:
-        logger.error(f"Get documents error: {e}")
+        logger.error("Get documents error: %s", e)
         return []
+
+    with _DOCS_CACHE_LOCK:
+        if _DOCS_GENERATION.get(user_id, 0) != generation:
+            return docs
+        _DOCS_CACHE[user_id] = (now + DOCS_CACHE_TTL, limit, docs)
+        _DOCS_CACHE.move_to_end(user_id)
+        if len(_DOCS_CACHE) > DOCS_CACHE_MAX:
+            _DOCS_CACHE.popitem(last=False)
+    return docs
+
+_SAVE_QUEUE: List[Tuple[FormData, asyncio.Future]] = []
+_SAVE_TIMER: Optional[asyncio.TimerHandle] = None
+_SAVE_TASKS = set()
+# One flush at a time, so concurrent batches never contend for the same users rows
+_SAVE_LOCK = asyncio.Lock()
+
+def _flush_document_saves():
+    """Hand everything queued so far to a single bulk insert."""
+    global _SAVE_QUEUE, _SAVE_TIMER
+    if _SAVE_TIMER is not None:
+        _SAVE_TIMER.cancel()
+        _SAVE_TIMER = None
+    batch, _SAVE_QUEUE = _SAVE_QUEUE, []
+    if batch:
+        task = asyncio.get_running_loop().create_task(_write_document_batch(batch))
+        _SAVE_TASKS.add(task)
+        task.add_done_callback(_SAVE_TASKS.discard)
+
+async def _write_document_batch(batch: List[Tuple[FormData, asyncio.Future]]):
+    doc_ids: List[Optional[int]] = []
+    try:
+        async with _SAVE_LOCK:
+            doc_ids = await run_db(save_documents_bulk, [form for form, _ in batch])
+    except Exception as e:
+        logger.error("Batched save error: %s", e)
     finally:
-        conn.close()
+        # Never leave a caller waiting, even if the write failed or was cancelled
+        for i, (_, fut) in enumerate(batch):
+            if not fut.done():
+                fut.set_result(doc_ids[i] if i < len(doc_ids) else None)
+
+async def queue_document_save(form_data: FormData) -> Optional[int]:
+    """Save a document, coalescing concurrent saves into one bulk insert.
+
+    Waits at most SAVE_BATCH_DELAY for other saves to join the batch (or until
+    SAVE_BATCH_MAX are queued) and returns the new ID, or None on failure.
+    """
+    global _SAVE_TIMER
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    _SAVE_QUEUE.append((form_data, fut))
+    if len(_SAVE_QUEUE) >= SAVE_BATCH_MAX:
+        _flush_document_saves()
+    elif _SAVE_TIMER is None:
+        _SAVE_TIMER = loop.call_later(SAVE_BATCH_DELAY, _flush_document_saves)
+    return await fut
+
+# =========================================================
+# PDF STYLES
+# =========================================================
+
+# Built once at import; getSampleStyleSheet() and ParagraphStyle setup are
+# comparatively expensive and the styles are never mutated by the generators.
+STYLES = getSampleStyleSheet()
+
+TITLE_STYLE = ParagraphStyle('Title', parent=STYLES['Heading1'], fontSize=18, alignment=1, spaceAfter=20)
+FOOTER_STYLE = ParagraphStyle('Footer', parent=STYLES['Normal'], fontSize=8, alignment=1, textColor=colors.grey)
+
+# Bill
+COMPANY_STYLE = ParagraphStyle('Company', parent=STYLES['Heading2'], fontSize=14, alignment=1)
+DUE_STYLE = ParagraphStyle('Due', parent=STYLES['Normal'], fontSize=12, alignment=1)
+
+# T4
+T4_TITLE_STYLE = ParagraphStyle('Title', parent=STYLES['Heading1'], fontSize=16, alignment=1, spaceAfter=10)
+YEAR_STYLE = ParagraphStyle('Year', parent=STYLES['Heading2'], fontSize=14, alignment=1)
+
+# Employment letter
+LETTER_HEADER_STYLE = ParagraphStyle('Header', parent=STYLES['Heading1'], fontSize=14, alignment=0, spaceAfter=5)
+LETTER_ADDRESS_STYLE = ParagraphStyle('Address', parent=STYLES['Normal'], fontSize=10, spaceAfter=20)
+LETTER_DATE_STYLE = ParagraphStyle('Date', parent=STYLES['Normal'], fontSize=11, spaceAfter=20)
+LETTER_TITLE_STYLE = ParagraphStyle('Title', parent=STYLES['Heading2'], fontSize=12, alignment=1, spaceAfter=20)
+LETTER_BODY_STYLE = ParagraphStyle('Body', parent=STYLES['Normal'], fontSize=11, leading=16, spaceAfter=15)
+
+# Table styles
+LABEL_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+PAYROLL_EARNINGS_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c3e50')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+])
+BANK_HEADER_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (0, 0), 14),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+])
+BANK_BALANCE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#27ae60')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 14),
+    ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+    ('TOPPADDING', (0, 0), (-1, -1), 15),
+])
+BILL_TO_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+])
+INVOICE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+])
+T4_INFO_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ('BOX', (0, 0), (-1, -1), 1, colors.black),
+    ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
+])
+T4_BOXES_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#c0392b')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+    ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+    ('TOPPADDING', (0, 0), (-1, -1), 10),
+])
+
+# Static flowables shared by every build. Flowables keep layout state from
+# wrap(), so two documents must never be built at once in the same process;
+# render_pdf gives each build its own worker process.
+T4_HEADINGS = {
+    "t1_general": [
+        Paragraph("T1 GENERAL - INCOME TAX AND BENEFIT RETURN", T4_TITLE_STYLE),
+        Paragraph("DECLARATION DE REVENUS ET DE PRESTATIONS", T4_TITLE_STYLE),
+    ],
+    "rl1_quebec": [
+        Paragraph("RL-1 - RELEVE 1", T4_TITLE_STYLE),
+        Paragraph("REVENUS D'EMPLOI ET REVENUS DIVERS", T4_TITLE_STYLE),
+    ],
+    "t4_standard": [
+        Paragraph("T4 - STATEMENT OF REMUNERATION PAID", T4_TITLE_STYLE),
+        Paragraph("ETAT DE LA REMUNERATION PAYEE", T4_TITLE_STYLE),
+    ],
+}
+T4_COPY_NOTICE = Paragraph("This is a copy for the employee / Copie de l'employe", FOOTER_STYLE)
+
+LETTER_TITLES = {
+    "letter_confirmation": [
+        Paragraph("EMPLOYMENT CONFIRMATION LETTER", LETTER_TITLE_STYLE),
+        Paragraph("LETTRE DE CONFIRMATION D'EMPLOI", LETTER_TITLE_STYLE),
+    ],
+    "letter_reference": [
+        Paragraph("LETTER OF REFERENCE", LETTER_TITLE_STYLE),
+        Paragraph("LETTRE DE REFERENCE", LETTER_TITLE_STYLE),
+    ],
+    "letter_income": [
+        Paragraph("INCOME VERIFICATION LETTER", LETTER_TITLE_STYLE),
+        Paragraph("ATTESTATION DE REVENUS", LETTER_TITLE_STYLE),
+    ],
+    "letter_termination": [
+        Paragraph("EMPLOYMENT TERMINATION LETTER", LETTER_TITLE_STYLE),
+        Paragraph("LETTRE DE FIN D'EMPLOI", LETTER_TITLE_STYLE),
+    ],
+}
+LETTER_GREETING = Paragraph("To Whom It May Concern / A qui de droit,", LETTER_BODY_STYLE)
+LETTER_SIGNATURE = [
+    Paragraph("Sincerely / Cordialement,", LETTER_BODY_STYLE),
+    Spacer(1, 30),
+    Paragraph("_________________________", LETTER_BODY_STYLE),
+    Paragraph("Authorized Signature / Signature autorisee", LETTER_ADDRESS_STYLE),
+]
 
 # =========================================================
 # PDF GENERATION FUNCTIONS
 # =========================================================
 
+# Capped at 12 integer digits so a parsed amount is always finite and fits in integer cents
+AMOUNT_RE = re.compile(r"-?(?:\d{1,12}(?:\.\d*)?|\.\d+)")
+# Drops currency signs, thousands separators and whitespace in a single pass
+AMOUNT_STRIP = str.maketrans("", "", "$, \t\n")
+
+def parse_amount(value: str) -> float:
+    """Parse a user-entered amount like '$2,500.00'; anything malformed is 0."""
+    raw = value.translate(AMOUNT_STRIP)
+    return float(raw) if AMOUNT_RE.fullmatch(raw) else 0.0
+
+def is_valid_amount(value: str) -> bool:
+    """Whether parse_amount would read `value` as a number rather than defaulting to 0."""
+    return AMOUNT_RE.fullmatch(value.translate(AMOUNT_STRIP)) is not None
+
+# Payroll deduction rates (flat, same for every province)
+CPP_RATE = 0.0595
+EI_RATE = 0.0163
+INCOME_TAX_RATE = 0.15
+
+@lru_cache(maxsize=4096)
+def compute_payroll_deductions(gross_cents: int) -> Tuple[float, float, float, float]:
+    """Return (cpp, ei, tax, net) for a gross pay given in integer cents."""
+    gross = gross_cents / 100
+    cpp = round(gross * CPP_RATE, 2)
+    ei = round(gross * EI_RATE, 2)
+    tax = round(gross * INCOME_TAX_RATE, 2)
+    net = round(gross - cpp - ei - tax, 2)
+    return cpp, ei, tax, net
+
 def generate_payroll_pdf(data: FormData) -> io.BytesIO:
     """Generate payroll PDF."""
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, pageCompression=1, topMargin=0.5*inch, bottomMargin=0.5*inch)
     elements = []
 
     # Title
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, alignment=1, spaceAfter=20)
-    elements.append(Paragraph("PAY STUB / TALON DE PAIE", title_style))
+    elements.append(Paragraph("PAY STUB / TALON DE PAIE", TITLE_STYLE))
     elements.append(Spacer(1, 20))
 
     # Employer info
@@ -389,11 +848,7 @@ def generate_payroll_pdf(data: FormData) -> io.BytesIO:
         ["Province:", data.province],
     ]
     employer_table = Table(employer_data, colWidths=[2.5*inch, 4*inch])
-    employer_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
+    employer_table.setStyle(LABEL_TABLE_STYLE)
     elements.append(employer_table)
     elements.append(Spacer(1, 20))
 
@@ -405,24 +860,13 @@ def generate_payroll_pdf(data: FormData) -> io.BytesIO:
         ["Phone / Tel:", data.phone],
     ]
     employee_table = Table(employee_data, colWidths=[2.5*inch, 4*inch])
-    employee_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
+    employee_table.setStyle(LABEL_TABLE_STYLE)
     elements.append(employee_table)
     elements.append(Spacer(1, 20))
 
     # Earnings
-    try:
-        gross = float(data.salary.replace(',', '').replace('$', ''))
-    except:
-        gross = 0
-
-    cpp = round(gross * 0.0595, 2)
-    ei = round(gross * 0.0163, 2)
-    tax = round(gross * 0.15, 2)
-    net = round(gross - cpp - ei - tax, 2)
+    gross = parse_amount(data.salary)
+    cpp, ei, tax, net = compute_payroll_deductions(round(gross * 100))
 
     earnings_data = [
         ["Description", "Earnings / Gains", "Deductions"],
@@ -435,23 +879,12 @@ def generate_payroll_pdf(data: FormData) -> io.BytesIO:
     ]
 
     earnings_table = Table(earnings_data, colWidths=[3*inch, 2*inch, 1.5*inch])
-    earnings_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c3e50')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-    ]))
+    earnings_table.setStyle(PAYROLL_EARNINGS_STYLE)
     elements.append(earnings_table)
 
     # Footer
     elements.append(Spacer(1, 30))
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=1, textColor=colors.grey)
-    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", footer_style))
+    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", FOOTER_STYLE))
 
     doc.build(elements)
     buffer.seek(0)
@@ -460,13 +893,11 @@ def generate_payroll_pdf(data: FormData) -> io.BytesIO:
 def generate_bank_statement_pdf(data: FormData) -> io.BytesIO:
     """Generate bank statement PDF."""
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, pageCompression=1, topMargin=0.5*inch, bottomMargin=0.5*inch)
     elements = []
 
     # Header
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, alignment=1, spaceAfter=20)
-    elements.append(Paragraph("BANK STATEMENT / RELEVE BANCAIRE", title_style))
+    elements.append(Paragraph("BANK STATEMENT / RELEVE BANCAIRE", TITLE_STYLE))
     elements.append(Spacer(1, 10))
 
     # Bank info
@@ -476,13 +907,7 @@ def generate_bank_statement_pdf(data: FormData) -> io.BytesIO:
         [f"Statement Date: {datetime.now().strftime('%B %Y')}"],
     ]
     bank_table = Table(bank_info, colWidths=[6.5*inch])
-    bank_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (0, 0), 14),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
+    bank_table.setStyle(BANK_HEADER_STYLE)
     elements.append(bank_table)
     elements.append(Spacer(1, 20))
 
@@ -493,39 +918,23 @@ def generate_bank_statement_pdf(data: FormData) -> io.BytesIO:
         ["City / Ville:", f"{data.city}, {data.postal_code}"],
     ]
     holder_table = Table(holder_data, colWidths=[2.5*inch, 4*inch])
-    holder_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
+    holder_table.setStyle(LABEL_TABLE_STYLE)
     elements.append(holder_table)
     elements.append(Spacer(1, 20))
 
     # Balance
-    try:
-        balance = float(data.balance.replace(',', '').replace('$', ''))
-    except:
-        balance = 0
+    balance = parse_amount(data.balance)
 
     balance_data = [
         ["Current Balance / Solde actuel", f"${balance:,.2f}"],
     ]
     balance_table = Table(balance_data, colWidths=[4*inch, 2.5*inch])
-    balance_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#27ae60')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 14),
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-        ('TOPPADDING', (0, 0), (-1, -1), 15),
-    ]))
+    balance_table.setStyle(BANK_BALANCE_STYLE)
     elements.append(balance_table)
 
     # Footer
     elements.append(Spacer(1, 30))
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=1, textColor=colors.grey)
-    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", footer_style))
+    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", FOOTER_STYLE))
 
     doc.build(elements)
     buffer.seek(0)
@@ -534,18 +943,15 @@ def generate_bank_statement_pdf(data: FormData) -> io.BytesIO:
 def generate_bill_pdf(data: FormData) -> io.BytesIO:
     """Generate bill/invoice PDF."""
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, pageCompression=1, topMargin=0.5*inch, bottomMargin=0.5*inch)
     elements = []
 
     # Header
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, alignment=1, spaceAfter=20)
-    elements.append(Paragraph("INVOICE / FACTURE", title_style))
+    elements.append(Paragraph("INVOICE / FACTURE", TITLE_STYLE))
     elements.append(Spacer(1, 10))
 
     # Company info
-    company_style = ParagraphStyle('Company', parent=styles['Heading2'], fontSize=14, alignment=1)
-    elements.append(Paragraph(data.company_name.upper(), company_style))
+    elements.append(Paragraph(data.company_name.upper(), COMPANY_STYLE))
     elements.append(Spacer(1, 20))
 
     # Bill to
@@ -556,19 +962,12 @@ def generate_bill_pdf(data: FormData) -> io.BytesIO:
         [f"{data.city}, {data.postal_code}", ""],
     ]
     bill_table = Table(bill_to_data, colWidths=[4*inch, 2.5*inch])
-    bill_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
+    bill_table.setStyle(BILL_TO_STYLE)
     elements.append(bill_table)
     elements.append(Spacer(1, 20))
 
     # Invoice details
-    try:
-        amount = float(data.amount.replace(',', '').replace('$', ''))
-    except:
-        amount = 0
+    amount = parse_amount(data.amount)
 
     tax = round(amount * 0.15, 2)
     total = round(amount + tax, 2)
@@ -581,28 +980,16 @@ def generate_bill_pdf(data: FormData) -> io.BytesIO:
     ]
 
     invoice_table = Table(invoice_data, colWidths=[4.5*inch, 2*inch])
-    invoice_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#3498db')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-    ]))
+    invoice_table.setStyle(INVOICE_TABLE_STYLE)
     elements.append(invoice_table)
     elements.append(Spacer(1, 20))
 
     # Due date
-    due_style = ParagraphStyle('Due', parent=styles['Normal'], fontSize=12, alignment=1)
-    elements.append(Paragraph(f"<b>Due Date / Echeance:</b> {data.due_date}", due_style))
+    elements.append(Paragraph(f"<b>Due Date / Echeance:</b> {data.due_date}", DUE_STYLE))
 
     # Footer
     elements.append(Spacer(1, 30))
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=1, textColor=colors.grey)
-    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", footer_style))
+    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", FOOTER_STYLE))
 
     doc.build(elements)
     buffer.seek(0)
@@ -611,28 +998,15 @@ def generate_bill_pdf(data: FormData) -> io.BytesIO:
 def generate_t4_pdf(data: FormData) -> io.BytesIO:
     """Generate T4/T4A PDF."""
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, pageCompression=1, topMargin=0.5*inch, bottomMargin=0.5*inch)
     elements = []
 
     # Header
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=1, spaceAfter=10)
-
-    if data.template_id == "t1_general":
-        elements.append(Paragraph("T1 GENERAL - INCOME TAX AND BENEFIT RETURN", title_style))
-        elements.append(Paragraph("DECLARATION DE REVENUS ET DE PRESTATIONS", title_style))
-    elif data.template_id == "rl1_quebec":
-        elements.append(Paragraph("RL-1 - RELEVE 1", title_style))
-        elements.append(Paragraph("REVENUS D'EMPLOI ET REVENUS DIVERS", title_style))
-    else:
-        elements.append(Paragraph("T4 - STATEMENT OF REMUNERATION PAID", title_style))
-        elements.append(Paragraph("ETAT DE LA REMUNERATION PAYEE", title_style))
-
+    elements.extend(T4_HEADINGS.get(data.template_id, T4_HEADINGS["t4_standard"]))
     elements.append(Spacer(1, 10))
 
     # Year
-    year_style = ParagraphStyle('Year', parent=styles['Heading2'], fontSize=14, alignment=1)
-    elements.append(Paragraph(f"Tax Year / Annee d'imposition: {data.tax_year}", year_style))
+    elements.append(Paragraph(f"Tax Year / Annee d'imposition: {data.tax_year}", YEAR_STYLE))
     elements.append(Spacer(1, 20))
 
     # Employer info
@@ -641,13 +1015,7 @@ def generate_t4_pdf(data: FormData) -> io.BytesIO:
         ["Business Number / Numero d'entreprise:", data.t4_employer_bn],
     ]
     employer_table = Table(employer_data, colWidths=[3*inch, 3.5*inch])
-    employer_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
-    ]))
+    employer_table.setStyle(T4_INFO_TABLE_STYLE)
     elements.append(employer_table)
     elements.append(Spacer(1, 15))
 
@@ -658,24 +1026,15 @@ def generate_t4_pdf(data: FormData) -> io.BytesIO:
         ["Province:", data.t4_province],
     ]
     employee_table = Table(employee_data, colWidths=[3*inch, 3.5*inch])
-    employee_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
-    ]))
+    employee_table.setStyle(T4_INFO_TABLE_STYLE)
     elements.append(employee_table)
     elements.append(Spacer(1, 20))
 
     # Income boxes
-    try:
-        income = float(data.employment_income.replace(',', '').replace('$', ''))
-        cpp = float(data.cpp_contribution.replace(',', '').replace('$', '')) if data.cpp_contribution else 0
-        ei = float(data.ei_premium.replace(',', '').replace('$', '')) if data.ei_premium else 0
-        tax = float(data.tax_deducted.replace(',', '').replace('$', '')) if data.tax_deducted else 0
-    except:
-        income = cpp = ei = tax = 0
+    income = parse_amount(data.employment_income)
+    cpp = parse_amount(data.cpp_contribution)
+    ei = parse_amount(data.ei_premium)
+    tax = parse_amount(data.tax_deducted)
 
     boxes_data = [
         ["Box / Case", "Description", "Amount / Montant"],
@@ -686,24 +1045,13 @@ def generate_t4_pdf(data: FormData) -> io.BytesIO:
     ]
 
     boxes_table = Table(boxes_data, colWidths=[1*inch, 3.5*inch, 2*inch])
-    boxes_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#c0392b')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-    ]))
+    boxes_table.setStyle(T4_BOXES_STYLE)
     elements.append(boxes_table)
 
     # Footer
     elements.append(Spacer(1, 30))
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=1, textColor=colors.grey)
-    elements.append(Paragraph("This is a copy for the employee / Copie de l'employe", footer_style))
-    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", footer_style))
+    elements.append(T4_COPY_NOTICE)
+    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", FOOTER_STYLE))
 
     doc.build(elements)
     buffer.seek(0)
@@ -712,45 +1060,25 @@ def generate_t4_pdf(data: FormData) -> io.BytesIO:
 def generate_employment_letter_pdf(data: FormData) -> io.BytesIO:
     """Generate employment letter PDF."""
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=1*inch, bottomMargin=1*inch)
-    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, pageCompression=1, topMargin=1*inch, bottomMargin=1*inch)
     elements = []
 
     # Letterhead
-    header_style = ParagraphStyle('Header', parent=styles['Heading1'], fontSize=14, alignment=0, spaceAfter=5)
-    elements.append(Paragraph(data.letter_employer_name.upper(), header_style))
+    elements.append(Paragraph(data.letter_employer_name.upper(), LETTER_HEADER_STYLE))
 
-    address_style = ParagraphStyle('Address', parent=styles['Normal'], fontSize=10, spaceAfter=20)
-    elements.append(Paragraph(data.letter_employer_address, address_style))
+    elements.append(Paragraph(data.letter_employer_address, LETTER_ADDRESS_STYLE))
     elements.append(Spacer(1, 20))
 
     # Date
-    date_style = ParagraphStyle('Date', parent=styles['Normal'], fontSize=11, spaceAfter=20)
-    elements.append(Paragraph(datetime.now().strftime("%B %d, %Y"), date_style))
+    elements.append(Paragraph(datetime.now().strftime("%B %d, %Y"), LETTER_DATE_STYLE))
     elements.append(Spacer(1, 10))
 
     # Title based on template
-    title_style = ParagraphStyle('Title', parent=styles['Heading2'], fontSize=12, alignment=1, spaceAfter=20)
-
-    if data.template_id == "letter_confirmation":
-        elements.append(Paragraph("EMPLOYMENT CONFIRMATION LETTER", title_style))
-        elements.append(Paragraph("LETTRE DE CONFIRMATION D'EMPLOI", title_style))
-    elif data.template_id == "letter_reference":
-        elements.append(Paragraph("LETTER OF REFERENCE", title_style))
-        elements.append(Paragraph("LETTRE DE REFERENCE", title_style))
-    elif data.template_id == "letter_income":
-        elements.append(Paragraph("INCOME VERIFICATION LETTER", title_style))
-        elements.append(Paragraph("ATTESTATION DE REVENUS", title_style))
-    else:
-        elements.append(Paragraph("EMPLOYMENT TERMINATION LETTER", title_style))
-        elements.append(Paragraph("LETTRE DE FIN D'EMPLOI", title_style))
-
+    elements.extend(LETTER_TITLES.get(data.template_id, LETTER_TITLES["letter_termination"]))
     elements.append(Spacer(1, 20))
 
     # Body
-    body_style = ParagraphStyle('Body', parent=styles['Normal'], fontSize=11, leading=16, spaceAfter=15)
-
-    elements.append(Paragraph("To Whom It May Concern / A qui de droit,", body_style))
+    elements.append(LETTER_GREETING)
     elements.append(Spacer(1, 10))
 
     if data.template_id == "letter_confirmation":
@@ -801,26 +1129,22 @@ def generate_employment_letter_pdf(data: FormData) -> io.BytesIO:
         <b>{data.letter_employer_name}</b> en tant que <b>{data.job_title}</b>.
         """
 
-    elements.append(Paragraph(body_text, body_style))
+    elements.append(Paragraph(body_text, LETTER_BODY_STYLE))
     elements.append(Spacer(1, 30))
 
     # Purpose if provided
     if data.letter_purpose:
         purpose_text = f"<b>Purpose / Objet:</b> {data.letter_purpose}"
-        elements.append(Paragraph(purpose_text, body_style))
+        elements.append(Paragraph(purpose_text, LETTER_BODY_STYLE))
         elements.append(Spacer(1, 20))
 
     # Signature
-    elements.append(Paragraph("Sincerely / Cordialement,", body_style))
-    elements.append(Spacer(1, 30))
-    elements.append(Paragraph("_________________________", body_style))
-    elements.append(Paragraph("Authorized Signature / Signature autorisee", address_style))
-    elements.append(Paragraph(data.letter_employer_name, address_style))
+    elements.extend(LETTER_SIGNATURE)
+    elements.append(Paragraph(data.letter_employer_name, LETTER_ADDRESS_STYLE))
 
     # Footer
     elements.append(Spacer(1, 30))
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=1, textColor=colors.grey)
-    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", footer_style))
+    elements.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}", FOOTER_STYLE))
 
     doc.build(elements)
     buffer.seek(0)
@@ -841,6 +1165,55 @@ def generate_pdf(data: FormData) -> io.BytesIO:
     else:
         return generate_payroll_pdf(data)
 
+_PDF_POOL: Optional[ProcessPoolExecutor] = None
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """Get the shared PDF worker pool, creating it on first use.
+
+    Workers come from a forkserver rather than fork(): by the time the first
+    PDF is requested the bot has DB pool sockets and DB worker threads that
+    children must not inherit.
+    """
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        _PDF_POOL = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _PDF_POOL
+
+def shutdown_pdf_pool():
+    """Stop the PDF worker processes."""
+    global _PDF_POOL
+    if _PDF_POOL is not None:
+        _PDF_POOL.shutdown()
+        _PDF_POOL = None
+
+def generate_pdf_bytes(data: FormData) -> bytes:
+    """Generate a PDF as bytes, ready to pass to reply_document."""
+    return generate_pdf(data).getvalue()
+
+def discard_pdf_pool(pool: ProcessPoolExecutor):
+    """Drop a broken worker pool so the next render starts a fresh one."""
+    global _PDF_POOL
+    if _PDF_POOL is pool:
+        _PDF_POOL = None
+    pool.shutdown(wait=False)
+
+async def render_pdf(data: FormData) -> bytes:
+    """Generate a PDF in the worker pool so rendering doesn't block the event loop.
+
+    Returns plain bytes, which reply_document accepts as-is.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_pdf_pool()
+    try:
+        return await loop.run_in_executor(pool, generate_pdf_bytes, data)
+    except BrokenProcessPool:
+        # A dead worker (OOM, crash) poisons the whole executor; replace it and retry once
+        logger.warning("PDF worker pool broke, starting a new one")
+        discard_pdf_pool(pool)
+        return await loop.run_in_executor(get_pdf_pool(), generate_pdf_bytes, data)
+
 # =========================================================
 # KEYBOARD BUILDERS
 # =========================================================
@@ -896,36 +1269,74 @@ def build_employment_type_keyboard() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("Contract / Contrat", callback_data="EMPTYPE_Contract")],
     ])
 
+def build_back_keyboard() -> InlineKeyboardMarkup:
+    """Build back-to-menu keyboard."""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("< Retour", callback_data="BACK_MAIN")]])
+
+# Keyboards are static (InlineKeyboardMarkup is immutable), so build them once
+MAIN_MENU_KEYBOARD = build_main_menu_keyboard()
+TEMPLATE_KEYBOARDS = {cat_key: build_template_keyboard(cat_key) for cat_key in TEMPLATES}
+SKIP_KEYBOARD = build_skip_keyboard()
+CONFIRM_KEYBOARD = build_confirm_keyboard()
+PROVINCE_KEYBOARD = build_province_keyboard()
+EMPLOYMENT_TYPE_KEYBOARD = build_employment_type_keyboard()
+BACK_KEYBOARD = build_back_keyboard()
+
 # =========================================================
 # HANDLERS
 # =========================================================
 
+CATEGORY_LIST_TEXT = (
+    "- PAYROLL - Talons de paie\n"
+    "- BANK STATEMENT - Releves bancaires\n"
+    "- BILL STATEMENT - Factures\n"
+    "- T4 / T1 - Releves fiscaux\n"
+    "- EMPLOYMENT LETTER - Lettres d'emploi"
+)
+START_TEXT = (
+    "Salut {name}!\n\n"
+    "Bienvenue sur DOCYWAY BOT\n"
+    "Generateur de documents professionnels\n\n"
+    "Choisis une categorie:\n"
+) + CATEGORY_LIST_TEXT
+HELP_TEXT = (
+    "DOCYWAY BOT - Aide\n\n"
+    "Ce bot genere des documents professionnels:\n\n"
+) + CATEGORY_LIST_TEXT + (
+    "\n\n"
+    "Commandes:\n"
+    "/start - Demarrer\n"
+    "/cancel - Annuler\n"
+    "/help - Aide"
+)
+CATEGORY_TEXTS = {
+    cat_key: f"Categorie: {cat_data['name']}\n{cat_data['description']}\n\nChoisis un template:"
+    for cat_key, cat_data in TEMPLATES.items()
+}
+
+def get_form(context: ContextTypes.DEFAULT_TYPE) -> FormData:
+    """Get the conversation's form, only building a new FormData when missing."""
+    form = context.user_data.get("form")
+    if form is None:
+        form = context.user_data["form"] = FormData()
+    return form
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle /start command."""
     user = update.effective_user
 
     # Save user to database
-    save_user(user.id, user.username or "", user.first_name or "", user.last_name or "")
+    await run_db(save_user, user.id, user.username or "", user.first_name or "", user.last_name or "")
 
     # Initialize form data
     context.user_data["form"] = FormData(user_id=user.id, username=user.username or "")
 
-    text = (
-        f"Salut {user.first_name or 'ami'}!\n\n"
-        "Bienvenue sur DOCYWAY BOT\n"
-        "Generateur de documents professionnels\n\n"
-        "Choisis une categorie:\n"
-        "- PAYROLL - Talons de paie\n"
-        "- BANK STATEMENT - Releves bancaires\n"
-        "- BILL STATEMENT - Factures\n"
-        "- T4 / T1 - Releves fiscaux\n"
-        "- EMPLOYMENT LETTER - Lettres d'emploi"
-    )
+    text = START_TEXT.format(name=user.first_name or 'ami')
 
     if update.message:
-        await update.message.reply_text(text, reply_markup=build_main_menu_keyboard())
+        await update.message.reply_text(text, reply_markup=MAIN_MENU_KEYBOARD)
     else:
-        await update.callback_query.edit_message_text(text, reply_markup=build_main_menu_keyboard())
+        await update.callback_query.edit_message_text(text, reply_markup=MAIN_MENU_KEYBOARD)
 
     return MAIN_MENU
 
@@ -946,18 +1357,12 @@ async def handle_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return MAIN_MENU
 
     category = data.replace("CAT_", "")
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.category = category
-    context.user_data["form"] = form
 
-    cat_info = TEMPLATES.get(category, {})
-    text = (
-        f"Categorie: {cat_info.get('name', category)}\n"
-        f"{cat_info.get('description', '')}\n\n"
-        "Choisis un template:"
-    )
+    text = CATEGORY_TEXTS.get(category) or f"Categorie: {category}\n\n\nChoisis un template:"
 
-    await query.edit_message_text(text, reply_markup=build_template_keyboard(category))
+    await query.edit_message_text(text, reply_markup=TEMPLATE_KEYBOARDS.get(category, BACK_KEYBOARD))
     return SELECT_TEMPLATE
 
 async def handle_template(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -970,27 +1375,15 @@ async def handle_template(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if data == "BACK_MAIN":
         return await start(update, context)
 
-    if not data.startswith("TPL_"):
+    template_id = TEMPLATE_CALLBACKS.get(data)
+    if template_id is None:
         return SELECT_TEMPLATE
 
-    parts = data.split("_", 2)
-    if len(parts) < 3:
-        return SELECT_TEMPLATE
-
-    category = parts[1]
-    template_id = parts[2]
+    category, template_name, _ = TEMPLATE_INDEX[template_id]
 
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.category = category
     form.template_id = template_id
-    context.user_data["form"] = form
-
-    # Find template name
-    template_name = template_id
-    for tpl in TEMPLATES.get(category, {}).get("templates", []):
-        if tpl["id"] == template_id:
-            template_name = tpl["name"]
-            break
 
     await query.edit_message_text(
         f"Template: {template_name}\n\n"
@@ -1004,59 +1397,53 @@ async def show_my_documents(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     user_id = update.effective_user.id
 
-    docs = get_user_documents(user_id)
+    docs = await run_db(get_user_documents, user_id)
 
     if not docs:
         text = "Tu n'as pas encore de documents.\n\nUtilise /start pour en creer un!"
     else:
         text = "Tes documents recents:\n\n"
         for doc in docs:
-            cat_name = TEMPLATES.get(doc['category'], {}).get('name', doc['category'])
+            cat_name = CATEGORY_NAMES.get(doc['category'], doc['category'])
             date_str = doc['created_at'].strftime('%Y-%m-%d %H:%M')
             text += f"- {cat_name} - {doc['template_id']} ({date_str})\n"
 
-    buttons = [[InlineKeyboardButton("< Retour", callback_data="BACK_MAIN")]]
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+    await query.edit_message_text(text, reply_markup=BACK_KEYBOARD)
     return MAIN_MENU
 
 # Basic form handlers
 async def handle_first_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.first_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Last name / Nom de famille:")
     return FORM_LAST_NAME
 
 async def handle_last_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.last_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Address / Adresse:")
     return FORM_ADDRESS
 
 async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.address = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("City / Ville:")
     return FORM_CITY
 
 async def handle_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.city = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Postal code / Code postal:")
     return FORM_POSTAL_CODE
 
 async def handle_postal_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.postal_code = update.message.text.strip()
-    context.user_data["form"] = form
-    await update.message.reply_text("Unit / Appartement (optional):", reply_markup=build_skip_keyboard())
+    await update.message.reply_text("Unit / Appartement (optional):", reply_markup=SKIP_KEYBOARD)
     return FORM_UNIT
 
 async def handle_unit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
@@ -1064,14 +1451,28 @@ async def handle_unit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     else:
         form.unit = update.message.text.strip()
 
-    context.user_data["form"] = form
-
     msg = update.callback_query.message if update.callback_query else update.message
-    await msg.reply_text("Phone / Telephone (optional):", reply_markup=build_skip_keyboard())
+    await msg.reply_text("Phone / Telephone (optional):", reply_markup=SKIP_KEYBOARD)
     return FORM_PHONE
 
+INVALID_AMOUNT_TEXT = "Invalid amount / Montant invalide (ex: 2500.00). Try again / Reessaie:"
+
+# Category -> (first category-specific prompt, its state)
+CATEGORY_FIRST_STEP = {
+    "payroll": ("Employer name / Nom de l'employeur:", PAYROLL_EMPLOYER),
+    "bank": ("Bank name / Nom de la banque:", BANK_NAME),
+    "bill": ("Company name / Nom de la compagnie:", BILL_COMPANY),
+    "t4": (
+        "Employer name / Nom de l'employeur:\n\n"
+        "(or everything at once / ou tout d'un coup:\n"
+        "employer;BN;year;province;income;CPP;EI;tax)",
+        T4_EMPLOYER_NAME,
+    ),
+    "employment_letter": ("Employer name / Nom de l'employeur:", LETTER_EMPLOYER_NAME),
+}
+
 async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
@@ -1081,51 +1482,40 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         form.phone = update.message.text.strip()
         msg = update.message
 
-    context.user_data["form"] = form
-
     # Route to category-specific questions
-    if form.category == "payroll":
-        await msg.reply_text("Employer name / Nom de l'employeur:")
-        return PAYROLL_EMPLOYER
-    elif form.category == "bank":
-        await msg.reply_text("Bank name / Nom de la banque:")
-        return BANK_NAME
-    elif form.category == "bill":
-        await msg.reply_text("Company name / Nom de la compagnie:")
-        return BILL_COMPANY
-    elif form.category == "t4":
-        await msg.reply_text("Employer name / Nom de l'employeur:")
-        return T4_EMPLOYER_NAME
-    elif form.category == "employment_letter":
-        await msg.reply_text("Employer name / Nom de l'employeur:")
-        return LETTER_EMPLOYER_NAME
-    else:
+    next_step = CATEGORY_FIRST_STEP.get(form.category)
+    if next_step is None:
         return await show_confirmation(update, context)
+    prompt, state = next_step
+    await msg.reply_text(prompt)
+    return state
 
 # Payroll handlers
 async def handle_payroll_employer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.employer_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Gross salary / Salaire brut (ex: 2500):")
     return PAYROLL_SALARY
 
 async def handle_payroll_salary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
-    form.salary = update.message.text.strip()
-    context.user_data["form"] = form
+    text = update.message.text.strip()
+    if not is_valid_amount(text):
+        await update.message.reply_text(INVALID_AMOUNT_TEXT)
+        return PAYROLL_SALARY
+
+    form = get_form(context)
+    form.salary = text
     await update.message.reply_text("Pay period / Periode de paie (ex: 2025-01-01 to 2025-01-15):")
     return PAYROLL_PERIOD
 
 async def handle_payroll_period(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.pay_period = update.message.text.strip()
-    context.user_data["form"] = form
-    await update.message.reply_text("Province:", reply_markup=build_province_keyboard())
+    await update.message.reply_text("Province:", reply_markup=PROVINCE_KEYBOARD)
     return PAYROLL_PROVINCE
 
 async def handle_payroll_province(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
@@ -1133,82 +1523,111 @@ async def handle_payroll_province(update: Update, context: ContextTypes.DEFAULT_
     else:
         form.province = update.message.text.strip()
 
-    context.user_data["form"] = form
     return await show_confirmation(update, context)
 
 # Bank handlers
 async def handle_bank_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.bank_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Account number / Numero de compte (last 4 digits):")
     return BANK_ACCOUNT
 
 async def handle_bank_account(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.account_number = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Current balance / Solde actuel (ex: 5000):")
     return BANK_BALANCE
 
 async def handle_bank_balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
-    form.balance = update.message.text.strip()
-    context.user_data["form"] = form
+    text = update.message.text.strip()
+    if not is_valid_amount(text):
+        await update.message.reply_text(INVALID_AMOUNT_TEXT)
+        return BANK_BALANCE
+
+    form = get_form(context)
+    form.balance = text
     return await show_confirmation(update, context)
 
 # Bill handlers
 async def handle_bill_company(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.company_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Service type / Type de service (ex: Electricity, Internet):")
     return BILL_SERVICE
 
 async def handle_bill_service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.service_type = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Amount due / Montant du (ex: 150):")
     return BILL_AMOUNT
 
 async def handle_bill_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
-    form.amount = update.message.text.strip()
-    context.user_data["form"] = form
+    text = update.message.text.strip()
+    if not is_valid_amount(text):
+        await update.message.reply_text(INVALID_AMOUNT_TEXT)
+        return BILL_AMOUNT
+
+    form = get_form(context)
+    form.amount = text
     await update.message.reply_text("Due date / Date d'echeance (ex: 2025-01-31):")
     return BILL_DUE_DATE
 
 async def handle_bill_due_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.due_date = update.message.text.strip()
-    context.user_data["form"] = form
     return await show_confirmation(update, context)
 
 # T4/T4A handlers
+
+# Field order for the one-message T4 shortcut; CPP, EI and tax are optional
+T4_BULK_FIELDS = (
+    "t4_employer_name", "t4_employer_bn", "tax_year", "t4_province",
+    "employment_income", "cpp_contribution", "ei_premium", "tax_deducted",
+)
+T4_BULK_MIN_FIELDS = 5
+T4_BULK_HINT = (
+    "Format: employer;BN;year;province;income;CPP;EI;tax\n"
+    "(CPP, EI and tax are optional / optionnels)"
+)
+
+async def handle_t4_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Fill the T4 fields from one semicolon-separated message."""
+    values = [value.strip() for value in update.message.text.split(";")]
+    if not T4_BULK_MIN_FIELDS <= len(values) <= len(T4_BULK_FIELDS):
+        await update.message.reply_text(T4_BULK_HINT)
+        return T4_EMPLOYER_NAME
+
+    # Income is required; the optional boxes may be left empty
+    income, *boxes = values[T4_BULK_MIN_FIELDS - 1:]
+    if not is_valid_amount(income) or not all(is_valid_amount(box) for box in boxes if box):
+        await update.message.reply_text(f"{INVALID_AMOUNT_TEXT}\n\n{T4_BULK_HINT}")
+        return T4_EMPLOYER_NAME
+
+    form = get_form(context)
+    for name, value in zip(T4_BULK_FIELDS, values):
+        setattr(form, name, value)
+    return await show_confirmation(update, context)
+
 async def handle_t4_employer_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.t4_employer_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Employer Business Number / Numero d'entreprise (ex: 123456789RC0001):")
     return T4_EMPLOYER_BN
 
 async def handle_t4_employer_bn(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.t4_employer_bn = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Tax year / Annee d'imposition (ex: 2024):")
     return T4_YEAR
 
 async def handle_t4_year(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.tax_year = update.message.text.strip()
-    context.user_data["form"] = form
-    await update.message.reply_text("Province:", reply_markup=build_province_keyboard())
+    await update.message.reply_text("Province:", reply_markup=PROVINCE_KEYBOARD)
     return T4_PROVINCE
 
 async def handle_t4_province(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
@@ -1218,97 +1637,104 @@ async def handle_t4_province(update: Update, context: ContextTypes.DEFAULT_TYPE)
         form.t4_province = update.message.text.strip()
         msg = update.message
 
-    context.user_data["form"] = form
     await msg.reply_text("Employment income / Revenus d'emploi (Box 14):")
     return T4_EMPLOYMENT_INCOME
 
 async def handle_t4_employment_income(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
-    form.employment_income = update.message.text.strip()
-    context.user_data["form"] = form
-    await update.message.reply_text("CPP contributions / Cotisations RPC (Box 16):", reply_markup=build_skip_keyboard())
+    text = update.message.text.strip()
+    if not is_valid_amount(text):
+        await update.message.reply_text(INVALID_AMOUNT_TEXT)
+        return T4_EMPLOYMENT_INCOME
+
+    form = get_form(context)
+    form.employment_income = text
+    await update.message.reply_text("CPP contributions / Cotisations RPC (Box 16):", reply_markup=SKIP_KEYBOARD)
     return T4_CPP_CONTRIBUTION
 
 async def handle_t4_cpp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
         form.cpp_contribution = ""
         msg = update.callback_query.message
     else:
-        form.cpp_contribution = update.message.text.strip()
+        text = update.message.text.strip()
+        if not is_valid_amount(text):
+            await update.message.reply_text(INVALID_AMOUNT_TEXT, reply_markup=SKIP_KEYBOARD)
+            return T4_CPP_CONTRIBUTION
+        form.cpp_contribution = text
         msg = update.message
 
-    context.user_data["form"] = form
-    await msg.reply_text("EI premiums / Cotisations AE (Box 18):", reply_markup=build_skip_keyboard())
+    await msg.reply_text("EI premiums / Cotisations AE (Box 18):", reply_markup=SKIP_KEYBOARD)
     return T4_EI_PREMIUM
 
 async def handle_t4_ei(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
         form.ei_premium = ""
         msg = update.callback_query.message
     else:
-        form.ei_premium = update.message.text.strip()
+        text = update.message.text.strip()
+        if not is_valid_amount(text):
+            await update.message.reply_text(INVALID_AMOUNT_TEXT, reply_markup=SKIP_KEYBOARD)
+            return T4_EI_PREMIUM
+        form.ei_premium = text
         msg = update.message
 
-    context.user_data["form"] = form
-    await msg.reply_text("Income tax deducted / Impot retenu (Box 22):", reply_markup=build_skip_keyboard())
+    await msg.reply_text("Income tax deducted / Impot retenu (Box 22):", reply_markup=SKIP_KEYBOARD)
     return T4_TAX_DEDUCTED
 
 async def handle_t4_tax(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
         form.tax_deducted = ""
     else:
-        form.tax_deducted = update.message.text.strip()
+        text = update.message.text.strip()
+        if not is_valid_amount(text):
+            await update.message.reply_text(INVALID_AMOUNT_TEXT, reply_markup=SKIP_KEYBOARD)
+            return T4_TAX_DEDUCTED
+        form.tax_deducted = text
 
-    context.user_data["form"] = form
     return await show_confirmation(update, context)
 
 # Employment Letter handlers
 async def handle_letter_employer_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.letter_employer_name = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Employer address / Adresse de l'employeur:")
     return LETTER_EMPLOYER_ADDRESS
 
 async def handle_letter_employer_address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.letter_employer_address = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Job title / Titre du poste:")
     return LETTER_JOB_TITLE
 
 async def handle_letter_job_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.job_title = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Start date / Date de debut (ex: 2023-01-15):")
     return LETTER_START_DATE
 
 async def handle_letter_start_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.start_date = update.message.text.strip()
-    context.user_data["form"] = form
     await update.message.reply_text("Annual salary / Salaire annuel:")
     return LETTER_SALARY
 
 async def handle_letter_salary(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.letter_salary = update.message.text.strip()
-    context.user_data["form"] = form
-    await update.message.reply_text("Employment type / Type d'emploi:", reply_markup=build_employment_type_keyboard())
+    await update.message.reply_text("Employment type / Type d'emploi:", reply_markup=EMPLOYMENT_TYPE_KEYBOARD)
     return LETTER_EMPLOYMENT_TYPE
 
 async def handle_letter_employment_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
@@ -1318,25 +1744,22 @@ async def handle_letter_employment_type(update: Update, context: ContextTypes.DE
         form.employment_type = update.message.text.strip()
         msg = update.message
 
-    context.user_data["form"] = form
-
     # If termination letter, ask for end date
     if form.template_id == "letter_termination":
         await msg.reply_text("End date / Date de fin (ex: 2025-01-15):")
         return LETTER_END_DATE
 
-    await msg.reply_text("Purpose / Objet de la lettre (optional):", reply_markup=build_skip_keyboard())
+    await msg.reply_text("Purpose / Objet de la lettre (optional):", reply_markup=SKIP_KEYBOARD)
     return LETTER_PURPOSE
 
 async def handle_letter_end_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
     form.end_date = update.message.text.strip()
-    context.user_data["form"] = form
-    await update.message.reply_text("Purpose / Objet de la lettre (optional):", reply_markup=build_skip_keyboard())
+    await update.message.reply_text("Purpose / Objet de la lettre (optional):", reply_markup=SKIP_KEYBOARD)
     return LETTER_PURPOSE
 
 async def handle_letter_purpose(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    form: FormData = context.user_data.get("form", FormData())
+    form = get_form(context)
 
     if update.callback_query:
         await update.callback_query.answer()
@@ -1344,45 +1767,43 @@ async def handle_letter_purpose(update: Update, context: ContextTypes.DEFAULT_TY
     else:
         form.letter_purpose = update.message.text.strip()
 
-    context.user_data["form"] = form
     return await show_confirmation(update, context)
 
 # Confirmation
+CONFIRMATION_HEADER = (
+    "CONFIRMATION\n\n"
+    "Category: {cat_name}\n"
+    "Template: {template_name}\n\n"
+    "Name: {first_name} {last_name}\n"
+    "Address: {address}\n"
+    "City: {city}, {postal_code}\n"
+)
+CONFIRMATION_FOOTER = "\nGenerer le document?"
+CONFIRMATION_DETAILS = {
+    "payroll": "\nEmployer: {employer_name}\nSalary: ${salary}\nPeriod: {pay_period}\n",
+    "bank": "\nBank: {bank_name}\nAccount: {account_number}\nBalance: ${balance}\n",
+    "bill": "\nCompany: {company_name}\nAmount: ${amount}\nDue: {due_date}\n",
+    "t4": "\nEmployer: {t4_employer_name}\nYear: {tax_year}\nIncome: ${employment_income}\n",
+    "employment_letter": "\nEmployer: {letter_employer_name}\nPosition: {job_title}\nSalary: ${letter_salary}\n",
+}
+# Full confirmation template per category, assembled once
+CONFIRMATION_TEMPLATES = {
+    cat_key: CONFIRMATION_HEADER + details + CONFIRMATION_FOOTER
+    for cat_key, details in CONFIRMATION_DETAILS.items()
+}
+
 async def show_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show confirmation screen."""
-    form: FormData = context.user_data.get("form", FormData())
-
-    cat_name = TEMPLATES.get(form.category, {}).get("name", form.category)
-    template_name = form.template_id
-    for tpl in TEMPLATES.get(form.category, {}).get("templates", []):
-        if tpl["id"] == form.template_id:
-            template_name = tpl["name"]
-            break
-
-    text = (
-        f"CONFIRMATION\n\n"
-        f"Category: {cat_name}\n"
-        f"Template: {template_name}\n\n"
-        f"Name: {form.first_name} {form.last_name}\n"
-        f"Address: {form.address}\n"
-        f"City: {form.city}, {form.postal_code}\n"
-    )
+    form = get_form(context)
 
-    if form.category == "payroll":
-        text += f"\nEmployer: {form.employer_name}\nSalary: ${form.salary}\nPeriod: {form.pay_period}\n"
-    elif form.category == "bank":
-        text += f"\nBank: {form.bank_name}\nAccount: {form.account_number}\nBalance: ${form.balance}\n"
-    elif form.category == "bill":
-        text += f"\nCompany: {form.company_name}\nAmount: ${form.amount}\nDue: {form.due_date}\n"
-    elif form.category == "t4":
-        text += f"\nEmployer: {form.t4_employer_name}\nYear: {form.tax_year}\nIncome: ${form.employment_income}\n"
-    elif form.category == "employment_letter":
-        text += f"\nEmployer: {form.letter_employer_name}\nPosition: {form.job_title}\nSalary: ${form.letter_salary}\n"
-
-    text += "\nGenerer le document?"
+    values = form.to_dict()
+    values["cat_name"] = CATEGORY_NAMES.get(form.category, form.category)
+    values["template_name"] = TEMPLATE_INDEX.get(form.template_id, (None, form.template_id, ""))[1]
+    template = CONFIRMATION_TEMPLATES.get(form.category, CONFIRMATION_HEADER + CONFIRMATION_FOOTER)
+    text = template.format_map(values)
 
     msg = update.callback_query.message if update.callback_query else update.message
-    await msg.reply_text(text, reply_markup=build_confirm_keyboard())
+    await msg.reply_text(text, reply_markup=CONFIRM_KEYBOARD)
     return CONFIRM
 
 async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1401,35 +1822,42 @@ async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
 
     if data == "CONFIRM_YES":
-        form: FormData = context.user_data.get("form", FormData())
+        form = get_form(context)
 
         await query.edit_message_text("Generation du PDF en cours...")
 
         try:
-            # Generate PDF
-            pdf_buffer = generate_pdf(form)
+            # Generate PDF; only record the document once it rendered
+            pdf_bytes = await render_pdf(form)
 
-            # Save to database
-            doc_id = save_document(form)
+            # Save to database in the background while the PDF uploads
+            save = asyncio.create_task(queue_document_save(form))
+            _SAVE_TASKS.add(save)
+            save.add_done_callback(_SAVE_TASKS.discard)
 
             # Get template name for filename
-            template_name = form.template_id
-            for tpl in TEMPLATES.get(form.category, {}).get("templates", []):
-                if tpl["id"] == form.template_id:
-                    template_name = tpl["name"].replace(" ", "_")
-                    break
+            template_name = TEMPLATE_FILE_NAMES.get(form.template_id, form.template_id)
 
             filename = f"{template_name}_{form.last_name}_{datetime.now().strftime('%Y%m%d')}.pdf"
 
             # Send PDF
-            await query.message.reply_document(
-                document=pdf_buffer,
+            sent = await query.message.reply_document(
+                document=pdf_bytes,
                 filename=filename,
-                caption=f"Document genere!\n\nID: {doc_id or 'N/A'}\n\nUtilise /start pour en creer un autre."
+                caption="Document genere!\n\nUtilise /start pour en creer un autre."
             )
 
+            # Add the document ID to the caption once the save has returned it
+            doc_id = await save
+            if doc_id is not None:
+                try:
+                    await sent.edit_caption(f"Document genere!\n\nID: {doc_id}\n\nUtilise /start pour en creer un autre.")
+                except Exception as e:
+                    # The PDF is already delivered; a missing ID isn't worth an error reply
+                    logger.warning("Caption update failed: %s", e)
+
         except Exception as e:
-            logger.error(f"PDF generation error: {e}")
+            logger.exception("PDF generation error: %s", e)
             await query.message.reply_text(f"Erreur lors de la generation: {str(e)}\n\nUtilise /start pour reessayer.")
 
         return ConversationHandler.END
@@ -1443,20 +1871,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command."""
-    text = (
-        "DOCYWAY BOT - Aide\n\n"
-        "Ce bot genere des documents professionnels:\n\n"
-        "- PAYROLL - Talons de paie\n"
-        "- BANK STATEMENT - Releves bancaires\n"
-        "- BILL STATEMENT - Factures\n"
-        "- T4 / T1 - Releves fiscaux\n"
-        "- EMPLOYMENT LETTER - Lettres d'emploi\n\n"
-        "Commandes:\n"
-        "/start - Demarrer\n"
-        "/cancel - Annuler\n"
-        "/help - Aide"
-    )
-    await update.message.reply_text(text)
+    await update.message.reply_text(HELP_TEXT)
 
 # =========================================================
 # MAIN
@@ -1471,7 +1886,15 @@ def main():
     init_database()
 
     # Build application
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # Queue outgoing calls under Telegram's flood limits instead of hitting RetryAfter
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=30, overall_time_period=1,
+        group_max_rate=20, group_time_period=60,
+    )
+    application = ApplicationBuilder().token(BOT_TOKEN).rate_limiter(rate_limiter).build()
+
+    # Plain text replies (not commands), shared by every form state
+    text_input = filters.TEXT & ~filters.COMMAND
 
     # Conversation handler
     conv_handler = ConversationHandler(
@@ -1484,124 +1907,126 @@ def main():
                 CallbackQueryHandler(handle_template, pattern=r"^(TPL_|BACK_MAIN)")
             ],
             FORM_FIRST_NAME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_first_name)
+                MessageHandler(text_input, handle_first_name)
             ],
             FORM_LAST_NAME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_last_name)
+                MessageHandler(text_input, handle_last_name)
             ],
             FORM_ADDRESS: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_address)
+                MessageHandler(text_input, handle_address)
             ],
             FORM_CITY: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_city)
+                MessageHandler(text_input, handle_city)
             ],
             FORM_POSTAL_CODE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_postal_code)
+                MessageHandler(text_input, handle_postal_code)
             ],
             FORM_UNIT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_unit),
+                MessageHandler(text_input, handle_unit),
                 CallbackQueryHandler(handle_unit, pattern=r"^SKIP$")
             ],
             FORM_PHONE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone),
+                MessageHandler(text_input, handle_phone),
                 CallbackQueryHandler(handle_phone, pattern=r"^SKIP$")
             ],
             # Payroll states
             PAYROLL_EMPLOYER: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_payroll_employer)
+                MessageHandler(text_input, handle_payroll_employer)
             ],
             PAYROLL_SALARY: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_payroll_salary)
+                MessageHandler(text_input, handle_payroll_salary)
             ],
             PAYROLL_PERIOD: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_payroll_period)
+                MessageHandler(text_input, handle_payroll_period)
             ],
             PAYROLL_PROVINCE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_payroll_province),
+                MessageHandler(text_input, handle_payroll_province),
                 CallbackQueryHandler(handle_payroll_province, pattern=r"^PROV_")
             ],
             # Bank states
             BANK_NAME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bank_name)
+                MessageHandler(text_input, handle_bank_name)
             ],
             BANK_ACCOUNT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bank_account)
+                MessageHandler(text_input, handle_bank_account)
             ],
             BANK_BALANCE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bank_balance)
+                MessageHandler(text_input, handle_bank_balance)
             ],
             # Bill states
             BILL_COMPANY: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bill_company)
+                MessageHandler(text_input, handle_bill_company)
             ],
             BILL_SERVICE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bill_service)
+                MessageHandler(text_input, handle_bill_service)
             ],
             BILL_AMOUNT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bill_amount)
+                MessageHandler(text_input, handle_bill_amount)
             ],
             BILL_DUE_DATE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_bill_due_date)
+                MessageHandler(text_input, handle_bill_due_date)
             ],
             # T4 states
             T4_EMPLOYER_NAME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_employer_name)
+                MessageHandler(text_input & filters.Regex(r";.*;.*;"), handle_t4_bulk),
+                MessageHandler(text_input, handle_t4_employer_name)
             ],
             T4_EMPLOYER_BN: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_employer_bn)
+                MessageHandler(text_input, handle_t4_employer_bn)
             ],
             T4_YEAR: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_year)
+                MessageHandler(text_input, handle_t4_year)
             ],
             T4_PROVINCE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_province),
+                MessageHandler(text_input, handle_t4_province),
                 CallbackQueryHandler(handle_t4_province, pattern=r"^PROV_")
             ],
             T4_EMPLOYMENT_INCOME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_employment_income)
+                MessageHandler(text_input, handle_t4_employment_income)
             ],
             T4_CPP_CONTRIBUTION: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_cpp),
+                MessageHandler(text_input, handle_t4_cpp),
                 CallbackQueryHandler(handle_t4_cpp, pattern=r"^SKIP$")
             ],
             T4_EI_PREMIUM: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_ei),
+                MessageHandler(text_input, handle_t4_ei),
                 CallbackQueryHandler(handle_t4_ei, pattern=r"^SKIP$")
             ],
             T4_TAX_DEDUCTED: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_t4_tax),
+                MessageHandler(text_input, handle_t4_tax),
                 CallbackQueryHandler(handle_t4_tax, pattern=r"^SKIP$")
             ],
             # Employment Letter states
             LETTER_EMPLOYER_NAME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_employer_name)
+                MessageHandler(text_input, handle_letter_employer_name)
             ],
             LETTER_EMPLOYER_ADDRESS: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_employer_address)
+                MessageHandler(text_input, handle_letter_employer_address)
             ],
             LETTER_JOB_TITLE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_job_title)
+                MessageHandler(text_input, handle_letter_job_title)
             ],
             LETTER_START_DATE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_start_date)
+                MessageHandler(text_input, handle_letter_start_date)
             ],
             LETTER_SALARY: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_salary)
+                MessageHandler(text_input, handle_letter_salary)
             ],
             LETTER_EMPLOYMENT_TYPE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_employment_type),
+                MessageHandler(text_input, handle_letter_employment_type),
                 CallbackQueryHandler(handle_letter_employment_type, pattern=r"^EMPTYPE_")
             ],
             LETTER_END_DATE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_end_date)
+                MessageHandler(text_input, handle_letter_end_date)
             ],
             LETTER_PURPOSE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_letter_purpose),
+                MessageHandler(text_input, handle_letter_purpose),
                 CallbackQueryHandler(handle_letter_purpose, pattern=r"^SKIP$")
             ],
             # Confirmation
             CONFIRM: [
-                CallbackQueryHandler(handle_confirmation, pattern=r"^CONFIRM_")
+                # Non-blocking so other users' updates keep flowing while a PDF renders
+                CallbackQueryHandler(handle_confirmation, pattern=r"^CONFIRM_", block=False)
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
@@ -1611,7 +2036,10 @@ def main():
     application.add_handler(CommandHandler("help", help_command))
 
     logger.info("Bot starting...")
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        shutdown_pdf_pool()
 
 if __name__ == "__main__":
     main()